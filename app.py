@@ -3,21 +3,30 @@
 # Single file: configuration, models, auth, all endpoints.
 
 import os
-import io
 import json
 import time
+import threading
 from collections import defaultdict
 from datetime import datetime, timezone
 from functools import wraps
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file, send_from_directory
+from flask import (
+    Flask, request, jsonify, render_template, redirect, url_for,
+    send_file, send_from_directory, g, session,
+)
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_login import (
     LoginManager, UserMixin,
     login_user, logout_user, login_required, current_user,
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import orjson   # optional — several times faster JSON encoding for list endpoints
+except ImportError:
+    orjson = None
+
 
 # ============================================================
 # RATE LIMITING (brute-force protection for /login)
@@ -46,14 +55,66 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-ZMIEN-NA
 # Using absolute path so gunicorn works regardless of the process CWD
 _base_dir = os.path.dirname(os.path.abspath(__file__))
 _data_dir  = os.path.join(_base_dir, 'data')
-db_url = os.environ.get('DATABASE_URL', f'sqlite:///{_data_dir}/sklepik.db')
-# Heroku/Railway provide URLs starting with "postgres://" — SQLAlchemy requires "postgresql://"
-if db_url.startswith('postgres://'):
-    db_url = db_url.replace('postgres://', 'postgresql://', 1)
+
+
+def _normalise_db_url(url: str) -> str:
+    # Heroku/Railway provide URLs starting with "postgres://" — SQLAlchemy requires "postgresql://"
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+db_url = _normalise_db_url(os.environ.get('DATABASE_URL', f'sqlite:///{_data_dir}/sklepik.db'))
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Connection pool (PostgreSQL/MySQL only — SQLite keeps the SQLAlchemy defaults).
+# Applies to the primary and the replica; size per gunicorn worker process.
+if not db_url.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size':     int(os.environ.get('DB_POOL_SIZE', '5')),
+        'max_overflow':  int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout':  int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle':  int(os.environ.get('DB_POOL_RECYCLE', '1800')),   # s; below server/proxy idle timeouts
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no'),
+    }
+
+# Optional read-only replica for report-style reads (see @read_replica)
+replica_url = os.environ.get('DATABASE_REPLICA_URL', '')
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': _normalise_db_url(replica_url)}
+# After a user's own write, their reads stay on the primary for this long (replication lag)
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', '10'))
+
+# Request capture (opt-in): path of a JSON-lines file; replay it later with replay.py
+app.config['CAPTURE_LOG'] = os.environ.get('CAPTURE_LOG', '')
+
+# Background jobs (import/export): worker threads per process; 0 = run jobs inline in the request
+# (PythonAnywhere does not run threads inside web apps)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', '1'))
+# A running job without progress for this long is failed (its worker was restarted or killed)
+app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', '600'))
+_jobs_dir = os.path.join(_data_dir, 'jobs')
+
+
+def _is_plain_select(clause) -> bool:
+    """SELECT without FOR UPDATE. INSERT/UPDATE/DELETE (incl. flushes) have is_select False.
+    FOR UPDATE is read from the private _for_update_arg — SQLAlchemy has no public accessor;
+    getattr keeps this from crashing if it is renamed (such a SELECT would then hit the replica)."""
+    return (clause is not None and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Sends plain SELECTs to the read replica inside @read_replica views; writes and
+    SELECT ... FOR UPDATE always go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and g.get('read_replica') and _is_plain_select(clause):
+            return db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login_page'
 
@@ -169,6 +230,35 @@ class AuditLog(db.Model):
         }
 
 
+class Job(db.Model):
+    """Background job (import/export) — state shared by all gunicorn workers via the DB."""
+    id          = db.Column(db.Integer, primary_key=True)
+    kind        = db.Column(db.String(20),  nullable=False)   # 'import' | 'export'
+    status      = db.Column(db.String(10),  nullable=False, default='queued')  # queued/running/done/error
+    progress    = db.Column(db.Integer,     default=0)        # 0-100
+    message     = db.Column(db.String(500), default='')
+    params      = db.Column(db.Text,        default='{}')     # JSON; import payload lives in a file
+    result      = db.Column(db.Text,        nullable=True)    # JSON
+    artifact    = db.Column(db.String(200), nullable=True)    # download filename (file in data/jobs)
+    user_id      = db.Column(db.Integer,     nullable=True)
+    created_ts   = db.Column(db.BigInteger,  nullable=False)
+    heartbeat_ts = db.Column(db.BigInteger,  nullable=True)    # last sign of life while 'running'
+    finished_ts  = db.Column(db.BigInteger,  nullable=True)
+
+    def to_dict(self):
+        return {
+            'id':           self.id,
+            'kind':         self.kind,
+            'status':       self.status,
+            'progress':     self.progress,
+            'message':      self.message,
+            'result':       json.loads(self.result) if self.result else None,
+            'download_url': f'/api/jobs/{self.id}/download' if self.artifact else None,
+            'created_ts':   self.created_ts,
+            'finished_ts':  self.finished_ts,
+        }
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -188,11 +278,40 @@ def admin_required(f):
     return decorated
 
 
-def log_action(action: str, detail: str = '') -> None:
-    """Writes an audit log entry to the current DB session. Caller is responsible for commit."""
+def _wrote_recently() -> bool:
+    """True within REPLICA_STICKY_SECONDS of the current user's last successful write."""
+    return time.time() - session.get('last_write', 0) <= app.config['REPLICA_STICKY_SECONDS']
+
+
+def read_replica(f):
+    """Read-only endpoint — queries go to DATABASE_REPLICA_URL when configured, except right
+    after the current user's own write (read-your-writes), which is served from the primary."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if replica_url and not _wrote_recently():
+            g.read_replica = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+@app.after_request
+def _remember_last_write(response):
+    """Marks the session after a successful write, so @read_replica reads it back from the primary."""
+    if replica_url and request.method != 'GET' and response.status_code < 400:
+        session['last_write'] = time.time()
+    return response
+
+
+def log_action(action: str, detail: str = '', user=None) -> None:
+    """Writes an audit log entry to the current DB session. Caller is responsible for commit.
+
+    `user` overrides current_user — background jobs run outside the request context.
+    """
     now = datetime.now(timezone.utc)
-    uname = current_user.username if current_user.is_authenticated else None
-    uid   = current_user.id       if current_user.is_authenticated else None
+    if user is None and current_user.is_authenticated:
+        user = current_user
+    uname = user.username if user else None
+    uid   = user.id       if user else None
     db.session.add(AuditLog(
         ts       = int(now.timestamp() * 1000),
         user_id  = uid,
@@ -202,6 +321,133 @@ def log_action(action: str, detail: str = '') -> None:
     ))
 
 
+# ============================================================
+# SERIALISATION — projected queries + fast JSON for list endpoints
+# ============================================================
+# List endpoints skip ORM instances and to_dict(): column-projected Core queries
+# return plain row tuples, encoded in one go into the response body.
+# Field shapes below must stay identical to the models' to_dict().
+# Responses are NOT streamed: an open SQLite cursor during client I/O would
+# block checkout writes ("database is locked").
+
+_ITEMS_CHUNK = 500   # sales per IN query when attaching items
+
+PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.emoji, Product.price,
+    Product.stock, Product.barcode, Product.category, Product.img,
+)
+SALE_COLUMNS = (Sale.id, Sale.ts, Sale.date, Sale.total, Sale.paid)
+SALE_ITEM_COLUMNS = (
+    SaleItem.product_id.label('id'),   # 'id' field for frontend compatibility
+    SaleItem.product_id, SaleItem.name, SaleItem.emoji, SaleItem.qty, SaleItem.price,
+)
+USER_COLUMNS = (
+    User.id, User.username, User.is_admin,
+    db.func.coalesce(User.must_change_password, False, type_=db.Boolean).label('must_change_password'),
+)
+AUDIT_COLUMNS = (
+    AuditLog.ts,
+    db.func.coalesce(AuditLog.username, '?').label('username'),
+    AuditLog.action, AuditLog.detail,
+)
+
+
+def dumps(obj) -> bytes:
+    """Compact UTF-8 JSON — orjson when installed, stdlib otherwise."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _attach_sale_items(sales: list) -> None:
+    """Fills 'items' for a chunk of sale dicts with one IN query."""
+    items = defaultdict(list)
+    if sales:
+        stmt = (db.select(SaleItem.sale_id, *SALE_ITEM_COLUMNS)
+                  .where(SaleItem.sale_id.in_([s['id'] for s in sales]))
+                  .order_by(SaleItem.id))
+        result = db.session.execute(stmt)
+        keys = tuple(result.keys())[1:]
+        for row in result:
+            items[row[0]].append(dict(zip(keys, row[1:])))
+    for s in sales:
+        s['items'] = items[s['id']]
+
+
+def fetch_json_array(stmt, attach=None) -> bytes:
+    """stmt's rows as an encoded JSON array. The result is fetched completely first,
+    so the DB is not read while the response is sent."""
+    result = db.session.execute(stmt)
+    keys = tuple(result.keys())
+    rows = [dict(zip(keys, row)) for row in result.all()]
+    if attach:
+        for start in range(0, len(rows), _ITEMS_CHUNK):
+            attach(rows[start:start + _ITEMS_CHUNK])
+    return dumps(rows)
+
+
+def json_response(body: bytes, download_name=None):
+    """application/json response from encoded bytes; download_name makes it an attachment."""
+    headers = {'Content-Disposition': f'attachment; filename={download_name}'} if download_name else None
+    return app.response_class(body, mimetype='application/json', headers=headers)
+
+
+# ============================================================
+# REQUEST CAPTURE (opt-in, for replay.py performance tests)
+# ============================================================
+
+_capture_lock = threading.Lock()
+
+# Never written to the capture log — replay.py logs in with its own credentials
+_CAPTURE_REDACT = {'password', 'old_password'}
+_CAPTURE_MAX_STR = 256
+
+
+def _sanitise(value):
+    """Strips secrets and long strings (base64 photos) but keeps the payload shape and size."""
+    if isinstance(value, dict):
+        return {k: ('***' if k in _CAPTURE_REDACT else _sanitise(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_sanitise(v) for v in value]
+    if isinstance(value, str) and len(value) > _CAPTURE_MAX_STR:
+        return 'x' * len(value)
+    return value
+
+
+@app.before_request
+def _capture_start():
+    if app.config['CAPTURE_LOG']:
+        request.environ['sklepik.capture_t0'] = time.time()
+
+
+@app.after_request
+def _capture_finish(response):
+    """Appends one JSON line per /api/* request: endpoint, sanitised body, timing, user."""
+    t0 = request.environ.get('sklepik.capture_t0')
+    if t0 is None or not request.path.startswith('/api/'):
+        return response
+    if request.is_json:
+        body = _sanitise(request.get_json(silent=True))
+    else:
+        body = None   # multipart uploads (backup import) are recorded without content
+    record = {
+        't':        int(t0 * 1000),
+        'ms':       round((time.time() - t0) * 1000, 2),
+        'endpoint': request.endpoint,
+        'method':   request.method,
+        'path':     request.full_path.rstrip('?'),
+        'json':     request.is_json,
+        'body':     body,
+        'user':     current_user.username if current_user.is_authenticated else None,
+        'status':   response.status_code,
+    }
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+    with _capture_lock:
+        with open(app.config['CAPTURE_LOG'], 'a', encoding='utf-8') as f:
+            f.write(line)
+    return response
+
+
 # ============================================================
 # AUTH — login / logout
 # ============================================================
@@ -295,8 +541,7 @@ def manifest():
 @app.route('/api/products', methods=['GET'])
 @login_required
 def get_products():
-    products = Product.query.order_by(Product.id).all()
-    return jsonify([p.to_dict() for p in products])
+    return json_response(fetch_json_array(db.select(*PRODUCT_COLUMNS).order_by(Product.id)))
 
 
 @app.route('/api/products', methods=['POST'])
@@ -374,20 +619,20 @@ def restock_product(pid):
 
 @app.route('/api/sales', methods=['GET'])
 @login_required
+@read_replica
 def get_sales():
     date      = request.args.get('date')
     date_from = request.args.get('date_from')
     date_to   = request.args.get('date_to')
-    query = Sale.query
+    stmt = db.select(*SALE_COLUMNS)
     if date:
-        query = query.filter_by(date=date)
+        stmt = stmt.filter_by(date=date)
     elif date_from or date_to:
         if date_from:
-            query = query.filter(Sale.date >= date_from)
+            stmt = stmt.filter(Sale.date >= date_from)
         if date_to:
-            query = query.filter(Sale.date <= date_to)
-    sales = query.order_by(Sale.ts.desc()).all()
-    return jsonify([s.to_dict() for s in sales])
+            stmt = stmt.filter(Sale.date <= date_to)
+    return json_response(fetch_json_array(stmt.order_by(Sale.ts.desc()), attach=_attach_sale_items))
 
 
 @app.route('/api/sales', methods=['POST'])
@@ -459,46 +704,169 @@ def create_sale():
 # BACKUP — export and import
 # ============================================================
 
+def _backup_filename(include_sales: bool) -> str:
+    prefix = 'sklepik_backup' if include_sales else 'sklepik_produkty'
+    return f"{prefix}_{datetime.now().strftime('%Y-%m-%d')}.json"
+
+
+def _build_backup(include_sales: bool, progress=None) -> bytes:
+    """Encoded backup JSON. Format compatible with the original static app."""
+    header   = dumps({'version': 2, 'exportedAt': datetime.now(timezone.utc).isoformat()})
+    products = fetch_json_array(db.select(*PRODUCT_COLUMNS).order_by(Product.id))
+    if progress:
+        progress(30, 'Produkty zapisane')
+    if include_sales:
+        sales = fetch_json_array(db.select(*SALE_COLUMNS).order_by(Sale.id), attach=_attach_sale_items)
+    else:
+        sales = b'[]'
+    if progress:
+        progress(90, 'Transakcje zapisane')
+    return header[:-1] + b',"products":' + products + b',"sales":' + sales + b'}'
+
+
+def _read_import_payload():
+    """Backup from the request — JSON body or multipart file upload. Returns (data, error)."""
+    if request.is_json:
+        return request.get_json(), None
+    file = request.files.get('file')
+    if not file:
+        return None, 'Brak pliku'
+    try:
+        return json.loads(file.read().decode('utf-8')), None
+    except json.JSONDecodeError:
+        return None, 'Nieprawidłowy plik JSON'
+
+
+def _is_int(value) -> bool:
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _validate_backup(data) -> str | None:
+    """Returns an error message, or None if the backup can be imported."""
+    if not isinstance(data, dict):
+        return 'Nieprawidłowy format backupu'
+    products_data = data.get('products', [])
+
+    # Validation: backup must have a non-empty product list
+    if not isinstance(products_data, list) or len(products_data) == 0:
+        return 'Backup nie zawiera produktów — import anulowany dla bezpieczeństwa'
+
+    # Validate that each product has the required fields
+    for i, p in enumerate(products_data):
+        if not isinstance(p, dict) or not p.get('name') or p.get('price') is None:
+            return f'Produkt #{i+1} ma nieprawidłowy format (brak name/price)'
+        if not _is_int(p['price']) or not _is_int(p.get('stock', 0)):
+            return f'Produkt #{i+1} ma nieprawidłową cenę lub stan magazynu'
+
+    # Catch broken sale records up front with a clear message instead of a failed transaction
+    if data.get('_import_sales'):
+        sales_data = data.get('sales', [])
+        if not isinstance(sales_data, list):
+            return 'Historia sprzedaży ma nieprawidłowy format'
+        for i, s in enumerate(sales_data):
+            if not isinstance(s, dict) or any(s.get(k) is None for k in ('ts', 'date', 'total')):
+                return f'Transakcja #{i+1} ma nieprawidłowy format (brak ts/date/total)'
+            items = s.get('items', [])
+            if not isinstance(items, list):
+                return f'Transakcja #{i+1} zawiera nieprawidłową pozycję'
+            for it in items:
+                if not isinstance(it, dict) or any(it.get(k) is None for k in ('name', 'qty', 'price')):
+                    return f'Transakcja #{i+1} zawiera nieprawidłową pozycję'
+    return None
+
+
+def _import_backup(data: dict, user=None, progress=None) -> dict:
+    """
+    Overwrites products, optionally sales too (data must pass _validate_backup).
+    All rows are built in memory first; the delete + insert then runs in a single
+    transaction, so a failed import leaves the database untouched.
+    """
+    products_data = data.get('products', [])
+    sales_data    = data.get('sales', [])
+    import_sales  = bool(data.get('_import_sales', False))
+
+    products = [Product(
+        id       = p_data.get('id'),
+        name     = p_data['name'],
+        emoji    = p_data.get('emoji', '🛒'),
+        price    = int(p_data['price']),
+        stock    = int(p_data.get('stock', 0)),
+        barcode  = p_data.get('barcode', ''),
+        category = p_data.get('category', 'Inne'),
+        img      = p_data.get('img', ''),
+    ) for p_data in products_data]
+
+    sales = []
+    if import_sales:
+        for n, s_data in enumerate(sales_data, 1):
+            # Items attached via the relationship — no flush per sale needed for sale.id
+            sales.append(Sale(
+                id      = s_data.get('id'),
+                ts      = s_data['ts'],
+                date    = s_data['date'],
+                total   = s_data['total'],
+                paid    = s_data.get('paid', s_data['total']),
+                items   = [SaleItem(
+                    product_id = i_data.get('id') or i_data.get('product_id'),
+                    name       = i_data['name'],
+                    emoji      = i_data.get('emoji', '🛒'),
+                    qty        = i_data['qty'],
+                    price      = i_data['price'],
+                ) for i_data in s_data.get('items', [])],
+            ))
+            if progress and n % 1000 == 0:
+                progress(60 * n // len(sales_data), f'Transakcje: {n}/{len(sales_data)}')
+    if progress:
+        progress(60, 'Zapisywanie…')
+
+    # Replace products (always)
+    Product.query.delete()
+    db.session.flush()
+    db.session.add_all(products)
+
+    # Sales history — only if the admin explicitly requested it
+    if import_sales:
+        SaleItem.query.delete()
+        Sale.query.delete()
+        db.session.flush()
+        db.session.add_all(sales)
+
+    log_action('IMPORT', f'Import backupu: {len(products_data)} produktów, '
+                         f'sprzedaż: {"tak" if import_sales else "nie (zachowana)"}', user=user)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'ok':            True,
+        'products':      Product.query.count(),
+        'sales':         Sale.query.count(),
+        'sales_replaced': import_sales,
+    }
+
+
 @app.route('/api/export', methods=['GET'])
 @login_required
 @admin_required
+@read_replica
 def export_backup():
     """Download full backup as a JSON file. Format compatible with the original static app."""
-    backup = {
-        'version':    2,
-        'exportedAt': datetime.now(timezone.utc).isoformat(),
-        'products':   [p.to_dict() for p in Product.query.all()],
-        'sales':      [s.to_dict() for s in Sale.query.all()],
-    }
-    filename  = f"sklepik_backup_{datetime.now().strftime('%Y-%m-%d')}.json"
-    json_data = json.dumps(backup, ensure_ascii=False, indent=2).encode('utf-8')
-    return send_file(
-        io.BytesIO(json_data),
-        mimetype='application/json',
-        as_attachment=True,
-        download_name=filename,
-    )
+    return json_response(_build_backup(include_sales=True), download_name=_backup_filename(include_sales=True))
 
 
 @app.route('/api/export/products', methods=['GET'])
 @login_required
 @admin_required
+@read_replica
 def export_products():
     """Download products only (without sales history)."""
-    backup = {
-        'version':    2,
-        'exportedAt': datetime.now(timezone.utc).isoformat(),
-        'products':   [p.to_dict() for p in Product.query.all()],
-        'sales':      [],
-    }
-    filename  = f"sklepik_produkty_{datetime.now().strftime('%Y-%m-%d')}.json"
-    json_data = json.dumps(backup, ensure_ascii=False, indent=2).encode('utf-8')
-    return send_file(
-        io.BytesIO(json_data),
-        mimetype='application/json',
-        as_attachment=True,
-        download_name=filename,
-    )
+    return json_response(_build_backup(include_sales=False), download_name=_backup_filename(include_sales=False))
 
 
 @app.route('/api/import', methods=['POST'])
@@ -509,83 +877,260 @@ def import_backup():
     Upload backup — overwrites products, optionally sales too.
     By default, sales history is NOT cleared — requires _import_sales=true flag.
     Accepts JSON body or multipart file upload.
+    Runs inside the request — the app uses /api/jobs/import for large backups.
     """
-    if request.is_json:
-        data = request.get_json()
-    else:
-        file = request.files.get('file')
-        if not file:
-            return jsonify({'error': 'Brak pliku'}), 400
-        try:
-            data = json.loads(file.read().decode('utf-8'))
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Nieprawidłowy plik JSON'}), 400
+    data, error = _read_import_payload()
+    if not error:
+        error = _validate_backup(data)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(_import_backup(data))
 
-    products_data = data.get('products', [])
-    sales_data    = data.get('sales', [])
-    import_sales  = bool(data.get('_import_sales', False))
 
-    # Validation: backup must have a non-empty product list
-    if not isinstance(products_data, list) or len(products_data) == 0:
-        return jsonify({'error': 'Backup nie zawiera produktów — import anulowany dla bezpieczeństwa'}), 400
+# ============================================================
+# BACKGROUND JOBS — heavy admin operations outside the request
+# ============================================================
 
-    # Validate that each product has the required fields
-    for i, p in enumerate(products_data):
-        if not isinstance(p, dict) or not p.get('name') or p.get('price') is None:
-            return jsonify({'error': f'Produkt #{i+1} ma nieprawidłowy format (brak name/price)'}), 400
+_job_workers_lock    = threading.Lock()
+_job_workers_started = False
+_job_wakeup          = threading.Event()
 
-    # Replace products (always)
-    Product.query.delete()
-    db.session.flush()
+JOB_RETENTION_MS = 24 * 3600 * 1000   # finished jobs and their files are purged after a day
+STALE_JOB_MESSAGE = 'Zadanie przerwane (restart serwera) — spróbuj ponownie'
 
-    for p_data in products_data:
-        db.session.add(Product(
-            id       = p_data.get('id'),
-            name     = p_data['name'],
-            emoji    = p_data.get('emoji', '🛒'),
-            price    = int(p_data['price']),
-            stock    = int(p_data.get('stock', 0)),
-            barcode  = p_data.get('barcode', ''),
-            category = p_data.get('category', 'Inne'),
-            img      = p_data.get('img', ''),
-        ))
 
-    # Sales history — only if the admin explicitly requested it
-    if import_sales:
-        SaleItem.query.delete()
-        Sale.query.delete()
-        db.session.flush()
+def _job_path(job_id: int, name: str) -> str:
+    return os.path.join(_jobs_dir, f'{job_id}-{name}')
 
-        for s_data in sales_data:
-            sale = Sale(
-                id      = s_data.get('id'),
-                ts      = s_data['ts'],
-                date    = s_data['date'],
-                total   = s_data['total'],
-                paid    = s_data.get('paid', s_data['total']),
-            )
-            db.session.add(sale)
-            db.session.flush()
 
-            for i_data in s_data.get('items', []):
-                db.session.add(SaleItem(
-                    sale_id    = sale.id,
-                    product_id = i_data.get('id') or i_data.get('product_id'),
-                    name       = i_data['name'],
-                    emoji      = i_data.get('emoji', '🛒'),
-                    qty        = i_data['qty'],
-                    price      = i_data['price'],
-                ))
+def _set_job_progress(job_id: int, progress: int, message: str = '') -> None:
+    Job.query.filter_by(id=job_id).update({
+        'progress':     progress,
+        'message':      message[:500],
+        'heartbeat_ts': int(time.time() * 1000),
+    })
+    db.session.commit()
 
-    log_action('IMPORT', f'Import backupu: {len(products_data)} produktów, '
-                         f'sprzedaż: {"tak" if import_sales else "nie (zachowana)"}')
+
+def _lease_cutoff(now: int) -> int:
+    return now - app.config['JOB_LEASE_SECONDS'] * 1000
+
+
+def _fail_stale_jobs() -> None:
+    """Fails 'running' jobs whose lease expired — a gunicorn worker restarted, redeployed
+    or killed mid-job never finishes them, and clients would poll them forever.
+    Writes to the DB, so it runs only at startup and before a job is claimed."""
+    now    = int(time.time() * 1000)
+    cutoff = _lease_cutoff(now)
+    Job.query.filter(
+        Job.status == 'running',
+        db.func.coalesce(Job.heartbeat_ts, Job.created_ts) < cutoff,
+    ).update({
+        'status':      'error',
+        'message':     STALE_JOB_MESSAGE,
+        'finished_ts': now,
+    }, synchronize_session=False)
     db.session.commit()
-    return jsonify({
-        'ok':            True,
-        'products':      Product.query.count(),
-        'sales':         Sale.query.count(),
-        'sales_replaced': import_sales,
+
+
+def _import_recently_active() -> bool:
+    """True while an import is pending or finished within REPLICA_STICKY_SECONDS —
+    an export must then read from the primary to include the imported data."""
+    cutoff = int((time.time() - app.config['REPLICA_STICKY_SECONDS']) * 1000)
+    return Job.query.filter(
+        Job.kind == 'import',
+        db.or_(Job.finished_ts.is_(None), Job.finished_ts > cutoff),
+    ).first() is not None
+
+
+def _run_job(job_id: int) -> None:
+    """Executes a claimed job and stores its result. Never raises."""
+    job    = db.session.get(Job, job_id)
+    user   = db.session.get(User, job.user_id) if job.user_id else None
+    params = json.loads(job.params or '{}')
+
+    def report(pct, msg=''):
+        _set_job_progress(job_id, pct, msg)
+
+    artifact = None
+    try:
+        if job.kind == 'import':
+            input_path = _job_path(job_id, 'input.json')
+            with open(input_path, encoding='utf-8') as f:
+                data = json.load(f)
+            result = _import_backup(data, user=user, progress=report)
+            os.remove(input_path)
+        elif job.kind == 'export':
+            include_sales = bool(params.get('sales', True))
+            g.read_replica = bool(replica_url) and not params.get('primary_only', True)
+            artifact = _backup_filename(include_sales)
+            with open(_job_path(job_id, artifact), 'wb') as f:
+                f.write(_build_backup(include_sales, progress=report))
+            result = {
+                'products': Product.query.count(),
+                'sales':    Sale.query.count() if include_sales else 0,
+            }
+        else:
+            raise ValueError(f'Nieznany typ zadania: {job.kind}')
+        status, message = 'done', ''
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('Job %s failed', job_id)
+        status, message, result, artifact = 'error', str(e), None, None
+    finally:
+        g.pop('read_replica', None)   # inline jobs share g with the submitting request
+
+    Job.query.filter_by(id=job_id).update({
+        'status':      status,
+        'progress':    100 if status == 'done' else Job.progress,
+        'message':     message[:500],
+        'result':      json.dumps(result) if result is not None else None,
+        'artifact':    artifact,
+        'finished_ts': int(time.time() * 1000),
     })
+    db.session.commit()
+
+
+def _claim_job(job_id: int) -> bool:
+    """Atomically moves a queued job to 'running' — safe across gunicorn workers."""
+    claimed = Job.query.filter_by(id=job_id, status='queued').update({
+        'status':       'running',
+        'heartbeat_ts': int(time.time() * 1000),
+    })
+    db.session.commit()
+    return bool(claimed)
+
+
+def _claim_next_job() -> int | None:
+    swept = False
+    while True:
+        job_id = db.session.execute(
+            db.select(Job.id).filter_by(status='queued').order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        if not swept:   # only when there is work — idle wakeups stay read-only
+            _fail_stale_jobs()
+            swept = True
+        if _claim_job(job_id):
+            return job_id
+
+
+def _job_worker_loop() -> None:
+    while True:
+        _job_wakeup.wait(timeout=5)   # also polls for jobs queued by the other gunicorn workers
+        _job_wakeup.clear()
+        with app.app_context():
+            try:
+                while (job_id := _claim_next_job()) is not None:
+                    _run_job(job_id)
+            except Exception:
+                app.logger.exception('Job worker error')
+            finally:
+                db.session.remove()
+
+
+def _ensure_job_workers() -> None:
+    """Starts worker threads lazily — after gunicorn has forked, in every worker that submits."""
+    global _job_workers_started
+    with _job_workers_lock:
+        if _job_workers_started:
+            return
+        for n in range(app.config['JOB_WORKERS']):
+            threading.Thread(target=_job_worker_loop, name=f'sklepik-job-{n}', daemon=True).start()
+        _job_workers_started = True
+
+
+def _purge_old_jobs() -> None:
+    cutoff = int(time.time() * 1000) - JOB_RETENTION_MS
+    for job in Job.query.filter(Job.finished_ts < cutoff).all():
+        for name in ('input.json', job.artifact):
+            if name and os.path.exists(_job_path(job.id, name)):
+                os.remove(_job_path(job.id, name))
+        db.session.delete(job)
+
+
+def _submit_job(kind: str, params: dict, payload=None):
+    """Queues a job (payload is written to a file, not the DB) and returns the 202 response."""
+    os.makedirs(_jobs_dir, exist_ok=True)
+    _purge_old_jobs()
+    job = Job(
+        kind       = kind,
+        params     = json.dumps(params),
+        user_id    = current_user.id,
+        created_ts = int(time.time() * 1000),
+    )
+    db.session.add(job)
+    db.session.flush()
+    if payload is not None:
+        with open(_job_path(job.id, 'input.json'), 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+    db.session.commit()
+
+    if app.config['JOB_WORKERS'] > 0:
+        _ensure_job_workers()
+        _job_wakeup.set()
+    elif _claim_job(job.id):
+        # No threads available — run inline, the client polls the same way
+        _run_job(job.id)
+    db.session.refresh(job)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/jobs/export', methods=['POST'])
+@login_required
+@admin_required
+def submit_export_job():
+    """Queue a backup export. Body: {"sales": true} (false = products only)."""
+    d = request.get_json(silent=True) or {}
+    # Decided now, while the submitting session is known: read-your-writes for the exporting
+    # admin, and a pending or just finished import job must be in the backup too
+    primary_only = bool(replica_url) and (_wrote_recently() or _import_recently_active())
+    return _submit_job('export', {'sales': bool(d.get('sales', True)), 'primary_only': primary_only})
+
+
+@app.route('/api/jobs/import', methods=['POST'])
+@login_required
+@admin_required
+def submit_import_job():
+    """Queue a backup import. Same body and validation as /api/import."""
+    data, error = _read_import_payload()
+    if not error:
+        error = _validate_backup(data)
+    if error:
+        return jsonify({'error': error}), 400
+    return _submit_job('import', {'sales': bool(data.get('_import_sales', False))}, payload=data)
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_job(job_id):
+    """Job status, progress (0-100) and result — polled by the frontend."""
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'error': 'Nie znaleziono zadania'}), 404
+    info = job.to_dict()
+    # Expired lease reported without writing — the row is failed at the next claim/startup
+    now = int(time.time() * 1000)
+    if job.status == 'running' and (job.heartbeat_ts or job.created_ts) < _lease_cutoff(now):
+        info.update(status='error', message=STALE_JOB_MESSAGE, finished_ts=now)
+    return jsonify(info)
+
+
+@app.route('/api/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+@admin_required
+def download_job_artifact(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or not job.artifact or not os.path.exists(_job_path(job_id, job.artifact)):
+        return jsonify({'error': 'Plik niedostępny'}), 404
+    return send_file(
+        _job_path(job_id, job.artifact),
+        mimetype='application/json',
+        as_attachment=True,
+        download_name=job.artifact,
+    )
 
 
 # ============================================================
@@ -596,7 +1141,7 @@ def import_backup():
 @login_required
 @admin_required
 def get_users():
-    return jsonify([u.to_dict() for u in User.query.all()])
+    return json_response(fetch_json_array(db.select(*USER_COLUMNS).order_by(User.id)))
 
 
 @app.route('/api/users', methods=['POST'])
@@ -668,10 +1213,11 @@ def change_password(uid):
 @app.route('/api/audit', methods=['GET'])
 @login_required
 @admin_required
+@read_replica
 def get_audit():
     """Last 200 audit log entries."""
-    entries = AuditLog.query.order_by(AuditLog.ts.desc()).limit(200).all()
-    return jsonify([e.to_dict() for e in entries])
+    stmt = db.select(*AUDIT_COLUMNS).order_by(AuditLog.ts.desc()).limit(200)
+    return json_response(fetch_json_array(stmt))
 
 
 # ============================================================
@@ -691,6 +1237,9 @@ def init_db():
         except Exception:
             pass  # column already exists
 
+    # Jobs interrupted by the previous shutdown
+    _fail_stale_jobs()
+
     if User.query.count() == 0:
         admin = User(username='admin', is_admin=True, must_change_password=True)
         admin.set_password('admin')
@@ -0,0 +1,262 @@
+# replay.py — Replays a captured request stream and compares latency between builds
+#
+# 1. Record real traffic:   CAPTURE_LOG=data/capture.jsonl gunicorn ... app:app
+# 2. Copy the database:     cp data/sklepik.db /tmp/replay.db
+# 3. Start a local instance on the copy, e.g.
+#        DATABASE_URL=sqlite:////tmp/replay.db python app.py
+# 4. Replay:                python replay.py run data/capture.jsonl -o old.jsonl --rate 2
+# 5. Repeat 2-4 on the new build (-o new.jsonl), then:
+#                           python replay.py compare old.jsonl new.jsonl
+#
+# NEVER replay against the production database — sales and stock changes are re-executed.
+# Standard library only, no extra dependencies.
+
+import argparse
+import http.cookiejar
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ============================================================
+# LOG I/O
+# ============================================================
+
+def load_records(path):
+    """Reads a JSON-lines file (capture log or replay results), oldest first.
+    Requests that matched no route (404/405) have endpoint null — grouped by path instead."""
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    for r in records:
+        r['endpoint'] = r.get('endpoint') or r.get('path') or '?'
+    return sorted(records, key=lambda r: r.get('t', 0))
+
+
+# ============================================================
+# RUN — re-drive a captured session
+# ============================================================
+
+class Session:
+    """Cookie-carrying HTTP client logged in as one user."""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        status, _ = self.send('POST', '/login', {'username': username, 'password': password})
+        if status != 200:
+            raise SystemExit(f'Login failed for {username!r} (HTTP {status})')
+
+    def send(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        t0 = time.perf_counter()
+        try:
+            with self.opener.open(req) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        return status, (time.perf_counter() - t0) * 1000
+
+
+def parse_credentials(pairs):
+    creds = {}
+    for pair in pairs:
+        name, sep, password = pair.partition('=')
+        if not sep:
+            raise SystemExit(f'--user expects NAME=PASSWORD, got {pair!r}')
+        creds[name] = password
+    return creds
+
+
+REDACTED = '***'   # what app.py writes instead of password fields
+
+
+def has_redacted(value):
+    if isinstance(value, dict):
+        return any(v == REDACTED or has_redacted(v) for v in value.values())
+    if isinstance(value, list):
+        return any(has_redacted(v) for v in value)
+    return False
+
+
+def cmd_run(args):
+    records = [r for r in load_records(args.capture) if r.get('json') or r['method'] == 'GET']
+    # Password changes / new accounts cannot be replayed — the password is not in the capture
+    redacted = [r for r in records if has_redacted(r.get('body'))]
+    records  = [r for r in records if not has_redacted(r.get('body'))]
+    if redacted:
+        print(f'Skipping {len(redacted)} requests with redacted passwords '
+              f'({", ".join(sorted({r["endpoint"] for r in redacted}))})')
+    if not records:
+        raise SystemExit('Nothing to replay (multipart uploads and password requests are not replayable)')
+
+    creds = parse_credentials(args.user)
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def session_for(username):
+        # Captured user when we know their password on the DB copy, else the default account
+        key = username if username in creds else None
+        with sessions_lock:
+            if key not in sessions:
+                if key is None:
+                    sessions[key] = Session(args.url, args.username, args.password)
+                else:
+                    sessions[key] = Session(args.url, key, creds[key])
+            return sessions[key]
+
+    results = []
+    results_lock = threading.Lock()
+
+    def replay_one(rec, due):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        status, ms = session_for(rec.get('user')).send(rec['method'], rec['path'], rec.get('body'))
+        with results_lock:
+            results.append({
+                't':           int(time.time() * 1000),
+                'ms':          round(ms, 2),
+                'endpoint':    rec['endpoint'],
+                'method':      rec['method'],
+                'status':      status,
+                'orig_status': rec.get('status'),
+            })
+
+    t_first = records[0]['t']
+    start = time.perf_counter() + 0.5   # leave time for logins before the first request
+    print(f'Replaying {len(records)} requests at {args.rate}x against {args.url} ...')
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(replay_one, rec, start + (rec['t'] - t_first) / 1000 / args.rate)
+            for rec in records
+        ]
+    for future in futures:
+        future.result()   # re-raise connection errors instead of silently dropping results
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for r in sorted(results, key=lambda r: r['t']):
+            f.write(json.dumps(r, separators=(',', ':')) + '\n')
+    print(f'Done: {len(results)} results written to {args.output}')
+    print_mismatches(results)
+    print_table(summarise(results))
+
+
+# ============================================================
+# COMPARE — latency distributions of two builds
+# ============================================================
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def is_mismatched(r):
+    """Replayed with a different status than captured (e.g. a fast 400 instead of a real 201)."""
+    return 'orig_status' in r and r['status'] != r['orig_status']
+
+
+def print_mismatches(records):
+    by_endpoint = defaultdict(int)
+    for r in records:
+        if is_mismatched(r):
+            by_endpoint[r['endpoint']] += 1
+    for endpoint, n in sorted(by_endpoint.items()):
+        print(f'⚠️  {endpoint}: {n} responses with a different status code than in the capture '
+              f'(excluded from latency stats)')
+
+
+def summarise(records):
+    """{endpoint: {'n', 'p50', 'p95', 'p99'}} from records carrying 'endpoint' and 'ms'.
+    Status-mismatched replays are left out so errors do not mix with real timings."""
+    by_endpoint = defaultdict(list)
+    for r in records:
+        if not is_mismatched(r):
+            by_endpoint[r['endpoint']].append(r['ms'])
+    stats = {}
+    for endpoint, values in by_endpoint.items():
+        values.sort()
+        stats[endpoint] = {
+            'n':   len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+    return stats
+
+
+def print_table(stats):
+    print(f'{"endpoint":<20} {"n":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for endpoint in sorted(stats):
+        s = stats[endpoint]
+        print(f'{endpoint:<20} {s["n"]:>6} {s["p50"]:>9.1f} {s["p95"]:>9.1f} {s["p99"]:>9.1f}')
+
+
+def cmd_compare(args):
+    base_records, cand_records = load_records(args.baseline), load_records(args.candidate)
+    print_mismatches(base_records + cand_records)
+    base = summarise(base_records)
+    cand = summarise(cand_records)
+    regressions = []
+    print(f'{"endpoint":<20} {"n":>6} {"p50 old→new":>19} {"p95 old→new":>19}')
+    for endpoint in sorted(set(base) & set(cand)):
+        b, c = base[endpoint], cand[endpoint]
+        # Ignore sub-millisecond noise on tiny endpoints (ping, me)
+        regressed = c['p95'] > b['p95'] * (1 + args.threshold) and c['p95'] - b['p95'] > args.min_ms
+        if regressed:
+            regressions.append(endpoint)
+        print(f'{endpoint:<20} {c["n"]:>6} {b["p50"]:>8.1f} → {c["p50"]:>8.1f} '
+              f'{b["p95"]:>8.1f} → {c["p95"]:>8.1f}  {"❌ REGRESSION" if regressed else ""}')
+    if regressions:
+        print(f'\n{len(regressions)} endpoint(s) slower by more than {args.threshold:.0%} at p95: '
+              + ', '.join(regressions))
+        return 1
+    print('\n✅ No latency regressions')
+    return 0
+
+
+# ============================================================
+# ENTRYPOINT
+# ============================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sklepik request replay and latency comparison')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='replay a capture log against a local instance')
+    run.add_argument('capture', help='JSON-lines file written with CAPTURE_LOG')
+    run.add_argument('-o', '--output', required=True, help='where to write per-request results')
+    run.add_argument('--url', default='http://localhost:6060')
+    run.add_argument('--rate', type=float, default=1.0, help='speed-up factor (2 = twice as fast)')
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--username', default='admin', help='account used for users without --user')
+    run.add_argument('--password', default='admin')
+    run.add_argument('--user', action='append', default=[], metavar='NAME=PASSWORD',
+                     help='replay requests of NAME as that user (repeatable)')
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser('compare', help='compare latency of two replay results (or capture logs)')
+    cmp_.add_argument('baseline')
+    cmp_.add_argument('candidate')
+    cmp_.add_argument('--threshold', type=float, default=0.2, help='allowed p95 slowdown (0.2 = 20%%)')
+    cmp_.add_argument('--min-ms', type=float, default=2.0, help='ignore slowdowns smaller than this')
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -332,6 +332,7 @@ async function init() {
   if (isOnline) syncPendingSales();
 
   initHwScanner();
+  startBarcodeWorker();   // pre-warm ZXing so the first camera scan is fast
 }
 
 async function loadProducts() {
@@ -1149,6 +1150,34 @@ async function changeMyPassword() {
 }
 
 // ================== BACKUP ==================
+// Import/export run as background jobs on the server — poll until done
+const JOB_POLL_TIMEOUT = 15 * 60 * 1000;   // ms — the server fails stuck jobs sooner (lease)
+
+async function waitForJob(job, label) {
+  const deadline = Date.now() + JOB_POLL_TIMEOUT;
+  while (job.status === 'queued' || job.status === 'running') {
+    if (Date.now() > deadline) throw new Error('Zadanie trwa zbyt długo — sprawdź później');
+    showToast(`⏳ ${label}… ${job.progress}%`);
+    await new Promise(r => setTimeout(r, 1000));
+    job = await api('GET', `/api/jobs/${job.id}`);
+    if (!job) throw new Error('Sesja wygasła');   // api() already redirects to /login on 401
+  }
+  if (job.status === 'error') throw new Error(job.message || 'Zadanie nie powiodło się');
+  return job;
+}
+
+async function doExport(includeSales) {
+  try {
+    const job  = await api('POST', '/api/jobs/export', { sales: includeSales });
+    if (!job) return;
+    const done = await waitForJob(job, 'Eksport');
+    window.location.href = done.download_url;
+    showToast(`✅ Backup gotowy (${done.result.products} produktów)`, 'green');
+  } catch (e) {
+    showToast('❌ ' + e.message, 'red');
+  }
+}
+
 function previewImport(input) {
   const file = input.files[0];
   if (!file) return;
@@ -1181,7 +1210,9 @@ async function doImport() {
   if (!confirm(msg)) return;
   try {
     const payload = { ...importData, _import_sales: importSales };
-    const result  = await api('POST', '/api/import', payload);
+    const job     = await api('POST', '/api/jobs/import', payload);
+    if (!job) return;
+    const result  = (await waitForJob(job, 'Import')).result;
     document.getElementById('importPreview').style.display    = 'none';
     document.getElementById('importBtn').style.display        = 'none';
     document.getElementById('importFileName').textContent     = 'Żaden plik nie wybrany';
@@ -1252,56 +1283,108 @@ function openScanner(mode) {
   input.click();
 }
 
+// Camera scans: ZXing runs in static/barcode-worker.js, never on the UI thread
+const SCAN_MAX_DIM = 1280;   // px — camera photos are downscaled before decoding
+let barcodeWorker  = null;
+let scanSeq        = 0;      // id of the current scan; bumping it cancels the previous one
+let pendingScan    = null;   // { id, resolve, reject } awaiting the worker's answer
+
 async function processScanImage(input) {
   if (!input.files || !input.files[0]) return;
   const file = input.files[0];
+  cancelScan();   // a newer photo supersedes any scan still being decoded
+  const id = ++scanSeq;
   document.getElementById('scannerOverlay').classList.remove('hidden');
   document.getElementById('scannerStatus').textContent = 'Szukam kodu kreskowego...';
   try {
-    const code = await decodeBarcode(file);
+    const code = await decodeBarcode(file, id);
+    if (id !== scanSeq) return;   // cancelled meanwhile
     closeScanner();
     if (code) handleScannedCode(code);
     else showToast('❌ Nie znaleziono kodu — spróbuj ponownie', 'red');
   } catch (e) {
+    if (e.name === 'AbortError' || id !== scanSeq) return;
     closeScanner();
     showToast('❌ Błąd skanowania: ' + e.message, 'red');
   }
 }
 
-async function decodeBarcode(file) {
+async function decodeBarcode(file, id) {
+  // createImageBitmap decodes the JPEG off the main thread
+  let bitmap = await createImageBitmap(file);
   if ('BarcodeDetector' in window) {
     try {
       const detector = new BarcodeDetector({
         formats: ['ean_13','ean_8','code_128','code_39','upc_a','upc_e','qr_code']
       });
-      const bitmap  = await createImageBitmap(file);
       const results = await detector.detect(bitmap);
-      if (results.length > 0) return results[0].rawValue;
+      if (results.length > 0) { bitmap.close(); return results[0].rawValue; }
     } catch (e) { console.warn('BarcodeDetector failed:', e); }
   }
-  try {
-    const img    = await loadImage(file);
-    const canvas = document.createElement('canvas');
-    canvas.width = img.naturalWidth; canvas.height = img.naturalHeight;
-    const ctx    = canvas.getContext('2d');
-    ctx.drawImage(img, 0, 0);
-    const imageData     = ctx.getImageData(0, 0, canvas.width, canvas.height);
-    const codeReader    = new ZXing.MultiFormatReader();
-    const lumSource     = new ZXing.RGBLuminanceSource(imageData.data, canvas.width, canvas.height);
-    const binaryBitmap  = new ZXing.BinaryBitmap(new ZXing.HybridBinarizer(lumSource));
-    const result        = codeReader.decode(binaryBitmap);
-    if (result) return result.getText();
-  } catch (e) { console.warn('ZXing failed:', e); }
-  return null;
-}
-
-function loadImage(file) {
-  return new Promise((res, rej) => {
-    const img = new Image();
-    const url = URL.createObjectURL(file);
-    img.onload  = () => { URL.revokeObjectURL(url); res(img); };
-    img.onerror = rej;
-    img.src = url;
+  bitmap = await downscaleBitmap(bitmap, SCAN_MAX_DIM);
+  if (id !== scanSeq) { bitmap.close(); return null; }
+  return decodeInWorker(bitmap, id);
+}
+
+async function downscaleBitmap(bitmap, maxDim) {
+  const scale = maxDim / Math.max(bitmap.width, bitmap.height);
+  if (scale >= 1) return bitmap;
+  const small = await createImageBitmap(bitmap, {
+    resizeWidth:   Math.round(bitmap.width  * scale),
+    resizeHeight:  Math.round(bitmap.height * scale),
+    resizeQuality: 'medium',
+  });
+  bitmap.close();
+  return small;
+}
+
+function startBarcodeWorker() {
+  if (barcodeWorker || !('Worker' in window)) return;
+  barcodeWorker = new Worker('/static/barcode-worker.js');
+  barcodeWorker.onmessage = ({ data }) => {
+    if (!pendingScan || data.id !== pendingScan.id) return;   // answer to a stale scan
+    const { resolve, reject } = pendingScan;
+    pendingScan = null;
+    if (data.error) reject(new Error(data.error));
+    else resolve(data.code);
+  };
+  barcodeWorker.onerror = e => {
+    console.warn('Barcode worker failed:', e.message);
+    if (pendingScan) { pendingScan.reject(new Error(e.message || 'Barcode worker')); pendingScan = null; }
+  };
+  barcodeWorker.postMessage({ type: 'warmup' });
+}
+
+function cancelScan() {
+  scanSeq++;
+  if (!pendingScan) return;
+  // A busy worker cannot receive messages — terminate it and start a fresh, pre-warmed one
+  barcodeWorker.terminate();
+  barcodeWorker = null;
+  pendingScan.reject(new DOMException('Scan cancelled', 'AbortError'));
+  pendingScan = null;
+  startBarcodeWorker();
+}
+
+function decodeInWorker(bitmap, id) {
+  startBarcodeWorker();
+  let msg;
+  if (typeof OffscreenCanvas !== 'undefined') {
+    // Zero-copy: the ImageBitmap is transferred, the worker reads its pixels
+    msg = [{ type: 'decode', id, bitmap }, [bitmap]];
+  } else {
+    // No OffscreenCanvas in the worker — read pixels here, transfer the buffer (still zero-copy)
+    const canvas  = document.createElement('canvas');
+    canvas.width  = bitmap.width;
+    canvas.height = bitmap.height;
+    canvas.getContext('2d').drawImage(bitmap, 0, 0);
+    bitmap.close();
+    const pixels = canvas.getContext('2d').getImageData(0, 0, canvas.width, canvas.height).data.buffer;
+    msg = [{ type: 'decode', id, width: canvas.width, height: canvas.height, pixels }, [pixels]];
+  }
+  return new Promise((resolve, reject) => {
+    pendingScan = { id, resolve, reject };
+    barcodeWorker.postMessage(...msg);
   });
 }
 
@@ -1329,6 +1412,7 @@ function handleScannedCode(code) {
 }
 
 function closeScanner() {
+  cancelScan();
   document.getElementById('scannerOverlay').classList.add('hidden');
 }
 
@@ -0,0 +1,66 @@
+// Barcode Worker — Sklepik Szkolny
+// Runs ZXing decoding off the UI thread so the POS screen stays responsive while scanning.
+//
+// In:  {type: 'warmup'}
+//      {type: 'decode', id, bitmap}                  — ImageBitmap (transferred, needs OffscreenCanvas)
+//      {type: 'decode', id, width, height, pixels}   — RGBA ArrayBuffer (transferred)
+// Out: {id, code}   — code is null when no barcode was found
+//      {id, error}
+
+importScripts('/static/zxing/zxing.min.js');
+
+let reader = null;
+
+function getReader() {
+  if (!reader) reader = new ZXing.MultiFormatReader();
+  return reader;
+}
+
+// RGBA → one luminance byte per pixel (same weights as ZXing: (R + 2G + B) / 4)
+function toLuminance(rgba, width, height) {
+  const lum = new Uint8ClampedArray(width * height);
+  for (let i = 0, p = 0; i < lum.length; i++, p += 4) {
+    lum[i] = (rgba[p] + 2 * rgba[p + 1] + rgba[p + 2]) >> 2;
+  }
+  return lum;
+}
+
+function bitmapPixels(bitmap) {
+  const canvas = new OffscreenCanvas(bitmap.width, bitmap.height);
+  const ctx    = canvas.getContext('2d');
+  ctx.drawImage(bitmap, 0, 0);
+  bitmap.close();
+  return ctx.getImageData(0, 0, canvas.width, canvas.height);
+}
+
+function decode(lum, width, height) {
+  const source = new ZXing.RGBLuminanceSource(lum, width, height);
+  const bitmap = new ZXing.BinaryBitmap(new ZXing.HybridBinarizer(source));
+  try {
+    return getReader().decode(bitmap).getText();
+  } catch (e) {
+    if (e instanceof ZXing.NotFoundException) return null;
+    throw e;
+  }
+}
+
+self.onmessage = ({ data }) => {
+  if (data.type === 'warmup') {
+    // JIT the decoder on a blank frame so the first real scan is not the slow one
+    try { decode(new Uint8ClampedArray(64 * 64), 64, 64); } catch (e) { /* nothing to find */ }
+    return;
+  }
+  if (data.type !== 'decode') return;
+  try {
+    let rgba, width, height;
+    if (data.bitmap) {
+      const img = bitmapPixels(data.bitmap);
+      rgba = img.data; width = img.width; height = img.height;
+    } else {
+      rgba = new Uint8ClampedArray(data.pixels); width = data.width; height = data.height;
+    }
+    self.postMessage({ id: data.id, code: decode(toLuminance(rgba, width, height), width, height) });
+  } catch (e) {
+    self.postMessage({ id: data.id, error: e.message || String(e) });
+  }
+};
@@ -4,7 +4,7 @@
 //
 // To force an update after deployment: change CACHE_NAME (e.g. sklepik-v2)
 
-const CACHE_NAME = 'sklepik-v19';
+const CACHE_NAME = 'sklepik-v21';
 
 // Resources pre-cached on SW install (entire UI shell)
 // NOTE: '/login' intentionally excluded — server may redirect to '/app' if user is logged in,
@@ -12,6 +12,7 @@ const CACHE_NAME = 'sklepik-v19';
 const PRECACHE_URLS = [
   '/app',
   '/static/app.js',
+  '/static/barcode-worker.js',
   '/static/zxing/zxing.min.js',
   '/static/fonts/Fredoka-latin.woff2',
   '/static/fonts/Fredoka-latin-ext.woff2',
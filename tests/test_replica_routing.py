@@ -0,0 +1,63 @@
+# Read-replica routing: reports read the (stale) replica, except right after the user's own write.
+# A SQLite copy of the primary stands in for a lagging PostgreSQL replica.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ['DATABASE_URL']         = f'sqlite:///{_tmp}/primary.db'
+os.environ['DATABASE_REPLICA_URL'] = f'sqlite:///{_tmp}/replica.db'
+os.environ['JOB_WORKERS']          = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402  (env must be set first)
+
+app = app_module.app
+app_module._jobs_dir = os.path.join(_tmp, 'jobs')   # keep export artifacts out of the repo
+
+# Replica frozen at the state before any sale
+shutil.copy(f'{_tmp}/primary.db', f'{_tmp}/replica.db')
+
+
+def _client():
+    c = app.test_client()
+    c.post('/login', json={'username': 'admin', 'password': 'admin'})
+    assert c.post('/api/sales', json={'items': [{'id': 1, 'qty': 1}]}).status_code == 201
+    return c
+
+
+def _age_last_write(c, seconds):
+    with c.session_transaction() as s:
+        s['last_write'] = time.time() - seconds
+
+
+def test_reads_primary_inside_sticky_window():
+    c = _client()
+    assert len(c.get('/api/sales').get_json()) >= 1
+
+
+def test_reads_stale_replica_after_sticky_window():
+    c = _client()
+    _age_last_write(c, app.config['REPLICA_STICKY_SECONDS'] + 1)
+    assert c.get('/api/sales').get_json() == []
+    # Checkout and the product list always use the primary
+    assert c.get('/api/products').get_json()[0]['stock'] < 20
+
+
+def test_export_job_reads_primary_after_own_write():
+    c = _client()
+    job = c.post('/api/jobs/export', json={'sales': True}).get_json()
+    assert job['status'] == 'done'
+    backup = json.loads(c.get(job['download_url']).data)
+    assert len(backup['sales']) >= 1
+
+
+def test_export_job_reads_replica_after_sticky_window():
+    c = _client()
+    _age_last_write(c, app.config['REPLICA_STICKY_SECONDS'] + 1)
+    job = c.post('/api/jobs/export', json={'sales': True}).get_json()
+    assert job['result']['sales'] == 0